@@ -1,6 +1,26 @@
 from .dissimilarity_calculator import DissimilarityCalculator
+from defSim.tools.FeatureMatrix import FeatureMatrix, get_feature_matrix
+from typing import Tuple
 import networkx as nx
+import numpy as np
+from scipy.spatial.distance import cdist
 import warnings
+import weakref
+
+try:
+    from ._within_threshold import within_threshold_matrix
+except ImportError:
+    within_threshold_matrix = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
 
 class WithinThresholdDistance(DissimilarityCalculator):
     """
@@ -8,10 +28,37 @@ class WithinThresholdDistance(DissimilarityCalculator):
     depends on the agreement threshold 'at'. Features are same or perceived as the same when they are within the 'at'
     The class contains the attribute 'exclude' which accepts a list of strings with the names of agent features that
     should not be used to calculate between agent similarity.
+    The attribute 'device' selects where calculate_dissimilarity_networkwide runs: "cpu" (default), or "cuda" to
+    compute all edges on the GPU with CuPy, which pays off for networks with hundreds of thousands of edges.
     """
 
-    def __init__(self, exclude=[]):
+    # slots instead of an instance dict make self.at and the caches cheaper to read in the per-pair loop
+    __slots__ = ('exclude', 'device', 'at', '_exclude_set', '_keys', '_denom', '_columns', '_kept', '_packed',
+                 '_edge_versions')
+
+    def __init__(self, exclude=[], device: str = "cpu"):
+        if device not in ("cpu", "cuda"):
+            raise ValueError("Can only select from the devices ['cpu', 'cuda']")
+        if device == "cuda" and cp is None:
+            raise ImportError("device='cuda' requires CuPy. Install the cupy package matching your CUDA version.")
         self.exclude = exclude
+        self.device = device
+        self._exclude_set = frozenset(exclude)
+        self._keys = None
+        self._denom = 0
+        self._columns = None
+        self._kept = None
+        self._packed = None
+        # per network: the agent versions at both ends of every edge when calculate_dissimilarity_networkwide last ran
+        self._edge_versions = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # the caches only hold for networks in this process, and a WeakKeyDictionary cannot be pickled, e.g. when an
+        # Experiment sends its simulations to worker processes
+        return {'exclude': self.exclude, 'device': self.device}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
 
     def calculate_dissimilarity(self, network: nx.Graph, agent1_id: int, agent2_id: int, **kwargs) -> float:
         """
@@ -26,26 +73,248 @@ class WithinThresholdDistance(DissimilarityCalculator):
         :param int=1 at: Agreement threshold as max. Distance to other attribute
         :returns a float value, representing the distance between the two agents
         """
+        self._set_agreement_threshold(**kwargs)
+        # todo: implement in such a way that only categorical attributes are considered, and others are ignored
+        # a plain loop over the two attribute dicts beats NumPy's call overhead for a single pair of agents
+        agent1 = network.nodes[agent1_id]
+        agent2 = network.nodes[agent2_id]
+        if self._keys is None:
+            self._keys = tuple(feature for feature in agent1 if feature not in self._exclude_set)
+            self._denom = len(agent1)
+        at = self.at
+        count = 0
+        for feature in self._keys:
+            if -at <= abs(agent1[feature]) - abs(agent2[feature]) <= at:
+                count += 1
+        return count / self._denom
+
+    def calculate_dissimilarity_networkwide(self, network: nx.Graph, **kwargs):
+        """
+        Calculates the distance from each agent to each other and sets that distance as an attribute on the edge
+        between them. On later calls for the same network, only the edges of agents whose features changed since the
+        previous call are recomputed, next to edges whose distance is missing or was changed by anything else.
+        :param network: The network that is modified.
+        :param kwargs: See calculate_dissimilarity.
+        """
+        self._set_agreement_threshold(**kwargs)
+        # agent features were (re)initialized, so neither the cached feature names nor the feature matrix can be trusted
+        self.reset()
+        matrix, columns = self._build_feature_matrix(network, rebuild=True)
+        edge_data = list(network.edges(data='dist', default=np.nan))
+        if not edge_data:
+            return
+        edges = [(agent, neighbor) for agent, neighbor, _ in edge_data]
+        stored = np.fromiter((dist for _, _, dist in edge_data), dtype=np.float64, count=len(edge_data))
+        src = np.fromiter((matrix.index[agent] for agent, _ in edges), dtype=np.intp, count=len(edges))
+        dst = np.fromiter((matrix.index[neighbor] for _, neighbor in edges), dtype=np.intp, count=len(edges))
+        src_versions = matrix.versions[src]
+        dst_versions = matrix.versions[dst]
+        key = (matrix, self.at, tuple(columns.tolist()))
+        previous = self._edge_versions.get(network)
+        if previous is not None and previous[0] == key and previous[1] == edges:
+            # only recompute the edges of which at least one agent changed since the last call, and the edges that no
+            # longer hold the distance written then, e.g. because they were removed and added again (NaN never equals)
+            dirty = np.flatnonzero((src_versions != previous[2]) | (dst_versions != previous[3]) |
+                                   (stored != previous[4]))
+        else:
+            dirty = np.arange(len(edges))
+        if len(dirty):
+            distances = self._networkwide_distances(matrix, columns, src[dirty], dst[dirty])
+            stored[dirty] = distances
+            adjacency = network.adj
+            for e, distance in zip(dirty.tolist(), distances.tolist()):
+                agent, neighbor = edges[e]
+                adjacency[agent][neighbor]['dist'] = distance
+        self._edge_versions[network] = (key, edges, src_versions, dst_versions, stored)
+
+    def _networkwide_distances(self, matrix: FeatureMatrix, columns: np.ndarray, src: np.ndarray,
+                               dst: np.ndarray) -> np.ndarray:
+        """
+        Computes the distances of a batch of pairs with the fastest implementation that is available.
+        :param matrix: The FeatureMatrix of the network.
+        :param columns: The indices of the columns that are not excluded.
+        :param src: The matrix rows of the first agent of each pair.
+        :param dst: The matrix rows of the second agent of each pair.
+        :returns: The distance per pair of agents.
+        """
+        if self.device == "cuda":
+            features = cp.asarray(self._kept_features(matrix, columns))
+            src_gpu = cp.asarray(src)
+            dst_gpu = cp.asarray(dst)
+            matches = (cp.abs(features[src_gpu] - features[dst_gpu]) <= self.at).sum(axis=1)
+            return cp.asnumpy(matches) / len(matrix.features)
+        if within_threshold_matrix is not None and matrix.values.dtype.kind == "i":
+            distances = np.empty(len(src), dtype=np.float64)
+            features = self._kept_features(matrix, columns)
+            within_threshold_matrix(features, self.at, distances, src, dst, len(matrix.features))
+            return distances
+        if njit is not None:
+            distances = np.empty(len(src), dtype=np.float64)
+            features = self._kept_features(matrix, columns)
+            _networkwide_numba(features, src, dst, self.at, len(matrix.features), distances)
+            return distances
+        return self._count_matches(matrix, columns, src, dst) / len(matrix.features)
+
+    def calculate_dissimilarity_matrix(self, network: nx.Graph, **kwargs) -> np.ndarray:
+        """
+        Calculates the distance between all pairs of agents, whether they are neighbors or not.
+        :param network: The network in which the agents exist.
+        :param kwargs: See calculate_dissimilarity.
+        :returns an array of shape (agents, agents) with the distances, rows and columns in the order of network.nodes()
+        """
+        self._set_agreement_threshold(**kwargs)
+        matrix, columns = self._build_feature_matrix(network)
+        order = [matrix.index[agent] for agent in network.nodes()]
+        features = np.abs(matrix.values[np.ix_(order, columns)])
+        if self.at == 0 and len(columns) > 0:
+            # scipy's hamming metric is the proportion of unequal features, in C over all pairs
+            mismatches = np.rint(cdist(features, features, metric="hamming") * len(columns))
+            matches = len(columns) - mismatches
+        else:
+            matches = np.zeros((len(order), len(order)), dtype=np.int64)
+            for k in range(len(columns)):
+                matches += np.abs(features[:, k, np.newaxis] - features[np.newaxis, :, k]) <= self.at
+        return matches / len(matrix.features)
+
+    def reset(self):
+        """
+        Forgets the feature names cached by calculate_dissimilarity, e.g. before the calculator is used for a network
+        whose agents have other features. calculate_dissimilarity_networkwide resets automatically.
+        """
+        self._keys = None
+        self._denom = 0
+
+    def _set_agreement_threshold(self, **kwargs):
         try:
             self.at = kwargs["agreement_threshold"]
         except KeyError:
             warnings.warn("agreement_threshold not specified, using default value 1")
             self.at = 1
-        # todo: implement in such a way that only categorical attributes are considered, and others are ignored
-        number_of_features = len(network.nodes[agent1_id])
-        return len([k for k in network.nodes[agent1_id] if
-                    abs(abs(network.nodes[agent1_id][k]) - abs(network.nodes[agent2_id][k])) <= self.at
-                    and k not in self.exclude])/number_of_features
 
-    def calculate_dissimilarity_networkwide(self, network: nx.Graph, **kwargs):
+    def _build_feature_matrix(self, network: nx.Graph, rebuild: bool = False) -> Tuple[FeatureMatrix, np.ndarray]:
         """
-        Calculates the distance from each agent to each other and sets that distance as an attribute on the edge
-        between them.
-        :param network: The network that is modified.
+        :param network: The network in which the agents exist.
+        :param rebuild: If True, the cached FeatureMatrix of the network is built from scratch.
+        :returns: The FeatureMatrix of the network and the indices of its columns that are not excluded.
+        """
+        matrix = get_feature_matrix(network, rebuild)
+        if self._columns is None or self._columns[0] is not matrix:
+            keep_mask = np.array([feature not in self._exclude_set for feature in matrix.features], dtype=bool)
+            self._columns = (matrix, np.flatnonzero(keep_mask))
+        return matrix, self._columns[1]
+
+    def _kept_features(self, matrix: FeatureMatrix, columns: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: The FeatureMatrix of the network.
+        :param columns: The indices of the columns that are not excluded.
+        :returns: A contiguous copy of the absolute values of the not excluded columns, in the narrow dtype of the
+            matrix. It is cached until the feature matrix changes.
+        """
+        key = (matrix, matrix.version)
+        if self._kept is None or self._kept[0] != key:
+            self._kept = (key, np.ascontiguousarray(np.abs(matrix.values[:, columns])))
+        return self._kept[1]
+
+    def _count_matches(self, matrix: FeatureMatrix, columns: np.ndarray, src: np.ndarray,
+                       dst: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: The FeatureMatrix of the network.
+        :param columns: The indices of the columns that are not excluded.
+        :param src: The matrix rows of the first agent of each pair.
+        :param dst: The matrix rows of the second agent of each pair.
+        :returns: The number of features within the agreement threshold per pair of agents.
+        """
+        packed = self._pack_rows(matrix, columns) if matrix.values.dtype.kind in "iu" else None
+        if packed is not None:
+            rows, guards, thresholds = packed
+            return _count_packed_matches(rows[src], rows[dst], guards, thresholds)
+        rows = self._kept_features(matrix, columns)
+        return _count_row_matches(rows[src], rows[dst], self.at)
+
+    def _pack_rows(self, matrix: FeatureMatrix, columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Bit-packs the absolute feature values of every agent into uint64 words. Each feature gets a lane of b + 1 bits,
+        where b bits hold the value plus the agreement threshold and the highest bit is a guard bit, see
+        _count_packed_matches. The packed rows are cached until the feature matrix changes.
+        :param matrix: The FeatureMatrix of the network, with integer values.
+        :param columns: The indices of the columns that are not excluded.
+        :returns: The packed rows of shape (agents, words), the guard bit mask and the agreement threshold of every
+            lane as one word each per column of the packed rows, or None if the values are too large to be packed or
+            the agreement threshold is not a non-negative integer
+        """
+        if self.at < 0 or not float(self.at).is_integer():
+            # the lanes are unsigned integers, such a threshold can only be compared row by row
+            return None
+        at = int(self.at)
+        key = (matrix, matrix.version, self.at, tuple(columns.tolist()))
+        if self._packed is not None and self._packed[0] == key:
+            return self._packed[1]
+        values = self._kept_features(matrix, columns).astype(np.uint64)
+        bits = (int(values.max(initial=0)) + at).bit_length()
+        if bits >= 63:
+            return None
+        lanes_per_word = 64 // (bits + 1)
+        n_words = max(-(-len(columns) // lanes_per_word), 1)
+        packed = np.zeros((values.shape[0], n_words), dtype=np.uint64)
+        guards = np.zeros(n_words, dtype=np.uint64)
+        thresholds = np.zeros(n_words, dtype=np.uint64)
+        for k in range(len(columns)):
+            word, shift = divmod(k, lanes_per_word)
+            shift = np.uint64(shift * (bits + 1))
+            packed[:, word] |= values[:, k] << shift
+            guards[word] |= np.uint64(1 << bits) << shift
+            thresholds[word] |= np.uint64(at) << shift
+        self._packed = (key, (packed, guards, thresholds))
+        return self._packed[1]
+
+
+def _count_row_matches(rows1: np.ndarray, rows2: np.ndarray, at) -> np.ndarray:
+    """
+    :param rows1: Feature rows of the first agent of each pair.
+    :param rows2: Feature rows of the second agent of each pair.
+    :param at: The agreement threshold.
+    :returns: The number of features within the agreement threshold per pair.
+    """
+    return np.count_nonzero(np.abs(np.abs(rows1) - np.abs(rows2)) <= at, axis=1)
+
+
+def _count_packed_matches(rows1: np.ndarray, rows2: np.ndarray, guards: np.ndarray,
+                          thresholds: np.ndarray) -> np.ndarray:
+    """
+    Counts per pair of packed rows in how many lanes the values lie within the agreement threshold of each other, with
+    a SWAR (SIMD within a register) subtraction over all lanes of a word at once. With the guard bit set, a lane holds
+    2^b + x + at before y is subtracted, which never borrows from the next lane, so the guard bit survives exactly when
+    x + at - y >= 0. A lane matches when that holds in both directions; for at == 0 this is plain equality.
+    :param rows1: Packed rows of the first agent of each pair.
+    :param rows2: Packed rows of the second agent of each pair.
+    :param guards: The guard bit of every lane, per word.
+    :param thresholds: The agreement threshold in every lane, per word.
+    :returns: The number of matching lanes per pair.
+    """
+    matches = (((rows1 + thresholds) | guards) - rows2) & (((rows2 + thresholds) | guards) - rows1) & guards
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(matches).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(matches.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _networkwide_numba(features, src, dst, at, n_features, out):
+        """
+        Compiled version of the networkwide loop: writes the WithinThreshold Distance of every pair (src[e], dst[e])
+        into out[e], with the edges spread over all cores.
+        :param features: The absolute, not excluded feature values, shape (agents, features).
+        :param src: The matrix rows of the first agent of each pair.
+        :param dst: The matrix rows of the second agent of each pair.
+        :param at: The agreement threshold.
+        :param n_features: The number of features including the excluded ones, used as denominator.
+        :param out: Preallocated float64 array that receives one distance per pair.
         """
-        for agent in network.nodes():
-            for neighbor in network.neighbors(agent):
-                network.edges[agent, neighbor]['dist'] = self.calculate_dissimilarity(network,
-                                                                                      agent,
-                                                                                      neighbor,
-                                                                                      **kwargs)
\ No newline at end of file
+        for e in prange(src.shape[0]):
+            i = src[e]
+            j = dst[e]
+            count = 0
+            for k in range(features.shape[1]):
+                if abs(features[i, k] - features[j, k]) <= at:
+                    count += 1
+            out[e] = count / n_features
@@ -0,0 +1,41 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, initializedcheck=False, cdivision=True
+"""
+Cython version of the networkwide WithinThreshold Distance loop. Optional: WithinThresholdDistance falls back to the
+Numba or NumPy implementation if this extension is not built. Build it in place with
+
+    cythonize -i dissimilarity_component/_within_threshold.pyx
+
+The edges are only spread over multiple cores if the extension is compiled with OpenMP (-fopenmp).
+"""
+from cython.parallel import prange
+
+ctypedef fused feature_t:
+    signed char
+    short
+    int
+    long long
+
+
+def within_threshold_matrix(const feature_t[:, ::1] features, double at, double[::1] out,
+                            const Py_ssize_t[::1] src, const Py_ssize_t[::1] dst, Py_ssize_t n_features):
+    """
+    Writes the WithinThreshold Distance of every pair (src[e], dst[e]) into out[e].
+
+    :param features: The absolute, not excluded feature values, shape (agents, features).
+    :param at: The agreement threshold.
+    :param out: Preallocated float64 array that receives one distance per pair.
+    :param src: The matrix rows of the first agent of each pair.
+    :param dst: The matrix rows of the second agent of each pair.
+    :param n_features: The number of features including the excluded ones, used as denominator.
+    """
+    cdef Py_ssize_t e, k, i, j, count
+    cdef long long difference
+    for e in prange(src.shape[0], nogil=True):
+        i = src[e]
+        j = dst[e]
+        count = 0
+        for k in range(features.shape[1]):
+            difference = features[i, k] - features[j, k]
+            if -at <= difference <= at:
+                count = count + 1
+        out[e] = <double> count / n_features
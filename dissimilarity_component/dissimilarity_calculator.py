@@ -11,6 +11,9 @@ class DissimilarityCalculator(ABC):
     should not be used to calculate between agent similarity.
     """
 
+    # no instance dict here, so that subclasses can be slot-only
+    __slots__ = ()
+
     def __init__(self, exclude=None):
         # documentation omitted
         self.exclude = exclude
@@ -1,12 +1,16 @@
-import random
 import warnings
+from collections import Counter
 
 import networkx as nx
+import numpy as np
 from .influence_sim import InfluenceOperator
 from ..tools.NetworkDistanceUpdater import update_dissimilarity
-from typing import List
+from typing import List, Union
 from defSim.dissimilarity_component.dissimilarity_calculator import DissimilarityCalculator
 
+# fallback when the simulation does not pass its seeded np_random_generator, created once instead of per call
+_RNG = np.random.default_rng()
+
 
 class AgreementThresholdSimilarityAdoption(InfluenceOperator):
     """
@@ -25,6 +29,8 @@ class AgreementThresholdSimilarityAdoption(InfluenceOperator):
     with categorical attributes in mind.
     """
 
+    __slots__ = ('regime', 'homophily', 'at')
+
     def __init__(self, regime: str, **kwargs):
         """
         :param regime: Either "one-to-one", "one-to-many" or "many-to-one"
@@ -56,7 +62,16 @@ class AgreementThresholdSimilarityAdoption(InfluenceOperator):
             warnings.warn("agreement_threshold not specified, using default value 1")
             self.at = 1
 
-    def spread_influence(self, network: nx.Graph, agent_i: int, agents_j: List[int] or int,
+    def _influence_probability(self, distance: float) -> float:
+        """
+        :param distance: The distance between the focal agent and a neighbor.
+        :returns: The probability of successful influence.
+        """
+        if distance >= .5:
+            return (1 / 2) ** (1 - self.homophily) * (1 - distance) ** self.homophily
+        return 1 - (1 / 2) ** (1 - self.homophily) * distance ** self.homophily
+
+    def spread_influence(self, network: nx.Graph, agent_i: int, agents_j: Union[List[int], int],
                          dissimilarity_measure: DissimilarityCalculator, attributes: List[str] = None,
                          **kwargs) -> bool:
         """
@@ -71,64 +86,80 @@ class AgreementThresholdSimilarityAdoption(InfluenceOperator):
         :returns: true if agent(s) were successfully influenced
         """
 
-        if type(agents_j) != list:
-            agents_j = [agents_j]
+        if not isinstance(agents_j, list):
+            # a single agent, or any other iterable of agents such as a tuple, ndarray or generator; a tuple that is
+            # itself a node label, as in grid_2d_graph, counts as a single agent
+            agents_j = [agents_j] if isinstance(agents_j, (int, np.integer)) or agents_j in network else list(agents_j)
 
         success = False
 
-        if attributes is None:
-            # if no specific attributes were given, take all of them
-            attributes = list(network.nodes[agent_i].keys())
+        # bind the NetworkX views once, every subscription of network.nodes or network.edges creates a new view
+        nodes = network.nodes
+        node_i = nodes[agent_i]
+        ties_i = network.adj[agent_i]  # the edges (agent_i, neighbor), keyed by neighbor
+
+        try:
+            rng = kwargs["np_random_generator"]
+        except KeyError:
+            warnings.warn("No Numpy Generator in parameter dictionary, using module default")
+            rng = _RNG
 
         if self.regime != "many-to-one":
-            incongruent_features = []
+            # look up every tie and neighbor once, everything after works on their distances and attribute dicts
+            distances = []
+            close_nodes = []
             for neighbor in agents_j:
-                if network.edges[agent_i, neighbor]['dist'] < 1:
-                    for feature in attributes:
-                        if network.nodes[agent_i][feature] != network.nodes[neighbor][feature] and\
-                                abs(abs(network.nodes[neighbor][feature])-abs(network.nodes[neighbor][feature])) <= self.at:
-                            if feature not in incongruent_features:
-                                incongruent_features.append(feature)  # append the feature name if they are not the same but within agreement threshold
+                distance = ties_i[neighbor]['dist']
+                distances.append(distance)
+                if distance < 1:
+                    close_nodes.append(nodes[neighbor])
+            if not close_nodes:
+                # most interactions end here, so the attributes are only looked up after this
+                return False
+            if attributes is None:
+                # if no specific attributes were given, take all of them
+                attributes = list(node_i.keys())
+            at = self.at
+            # features in which any close neighbor is not the same but within the agreement threshold, read from the
+            # nodes themselves because their traits may have been set without update_dissimilarity
+            incongruent_features = [feature for feature in attributes
+                                    if any(node[feature] != node_i[feature] and
+                                           abs(abs(node[feature]) - abs(node_i[feature])) <= at
+                                           for node in close_nodes)]
             if len(incongruent_features) == 0:
                 return False
             else:
-                influenced_feature = random.choice(incongruent_features)
-                for neighbor in agents_j:
-                    if network.edges[agent_i, neighbor]['dist'] >= .5:
-                        p_infl_success = (
-                                (1 / 2) ** (1 - self.homophily) * (
-                                    1 - network.edges[agent_i, neighbor]['dist']) ** self.homophily)
-                    else:
-                        p_infl_success = (1 - (1 / 2) ** (1 - self.homophily) * (
-                                1 - (1 - network.edges[agent_i, neighbor]['dist'])) ** self.homophily)
-                    if random.uniform(0, 1) < p_infl_success:
-                        success = True
-                        network.nodes[neighbor][influenced_feature] = network.nodes[agent_i][influenced_feature]
-                        update_dissimilarity(network, [neighbor], dissimilarity_measure, **kwargs)
+                # all randomness of this interaction in one call: a draw per neighbor and a last one to pick the feature
+                draws = rng.random(len(agents_j) + 1)
+                influenced_feature = incongruent_features[int(draws[-1] * len(incongruent_features))]
+                influenced = [neighbor for neighbor, distance, draw in zip(agents_j, distances, draws.tolist())
+                              if draw < self._influence_probability(distance)]
+                influenced_value = node_i[influenced_feature]
+                for neighbor in influenced:
+                    nodes[neighbor][influenced_feature] = influenced_value
+                if influenced:
+                    success = True
+                    update_dissimilarity(network, influenced, dissimilarity_measure, **kwargs)
         else:
             raise NotImplementedError('Agreement threshold is not implemented for many-to-one')
+            if attributes is None:
+                attributes = list(node_i.keys())
             close_neighbors = []
             for neighbor in agents_j:
-                if network.edges[agent_i, neighbor]['dist'] >= .5:
-                    p_infl_success = (
-                            (1 / 2) ** (1 - self.homophily) * (1 - network.edges[agent_i, neighbor]['dist']) ** self.homophily)
-                else:
-                    p_infl_success = (1 - (1 / 2) ** (1 - self.homophily) * (
-                            1 - (1 - network.edges[agent_i, neighbor]['dist'])) ** self.homophily)
-                if random.uniform(0, 1) < p_infl_success:
+                p_infl_success = self._influence_probability(ties_i[neighbor]['dist'])
+                if rng.random() < p_infl_success:
                     close_neighbors.append(neighbor)
             incongruent_features = []  # [feature for feature in attributes if network.nodes[agent1]]
             incongruent_feature_values = []
             for feature in attributes:
-                neighbors_features = [value for key, value in nx.get_node_attributes(network, feature).items() if
-                                      key in close_neighbors]
+                neighbors_features = [nodes[neighbor][feature] for neighbor in close_neighbors]
                 # if len(set(neighbors_features))is one there is consensus
                 if len(set(neighbors_features)) != 1 and len(neighbors_features) != 0:
                     incongruent_features.append(feature)
-                    # max(neighbors_features, key=neighbors_features.count) calculates the mode
-                    incongruent_feature_values.append(max(neighbors_features, key=neighbors_features.count))
+                    # Counter(neighbors_features).most_common(1) calculates the mode
+                    incongruent_feature_values.append(Counter(neighbors_features).most_common(1)[0][0])
             if len(incongruent_features) != 0:  # if the list is not empty
-                influenced_featureID = random.choice([i for i in range(len(incongruent_features))])
+                influenced_featureID = rng.integers(len(incongruent_features))
                 # if the focal agent does not already
                 if network.nodes[agent_i][incongruent_features[influenced_featureID]] != incongruent_feature_values[
                     influenced_featureID]:
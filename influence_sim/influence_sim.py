@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 import networkx as nx
 from defSim.dissimilarity_component.dissimilarity_calculator import DissimilarityCalculator
-from typing import List
+from typing import List, Union
 import inspect
 
 
@@ -11,6 +11,9 @@ class InfluenceOperator(ABC):
     can be something like bounded confidence, negative influence or only positive influence.
     """
 
+    # no instance dict here, so that subclasses can be slot-only
+    __slots__ = ()
+
     def __init__(self, regime: str, **kwargs):
       """
       :param regime: This string determines the mode in which the agents influence each other.
@@ -24,7 +27,7 @@ class InfluenceOperator(ABC):
     def spread_influence(self, 
                          network: nx.Graph,
                          agent_i: int,
-                         agents_j: List[int] or int,
+                         agents_j: Union[List[int], int],
                          dissimilarity_measure: DissimilarityCalculator,
                          attributes: List[str] = None,
                          **kwargs) -> bool:
@@ -50,7 +53,7 @@ class InfluenceOperator(ABC):
 def spread_influence(network: nx.Graph,
                      realization: str,
                      agent_i: int,
-                     agents_j: List[int] or int,
+                     agents_j: Union[List[int], int],
                      regime: str,
                      dissimilarity_measure: DissimilarityCalculator,
                      attributes: List[str] = None,
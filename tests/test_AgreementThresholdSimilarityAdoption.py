@@ -0,0 +1,62 @@
+import networkx as nx
+import numpy as np
+from defSim.dissimilarity_component.WithinThresholdDistance import WithinThresholdDistance
+from defSim.influence_sim.AgreementThresholdSimilarityAdoption import AgreementThresholdSimilarityAdoption
+
+PARAMETERS = {"homophily": 1, "agreement_threshold": 1}
+
+
+def _pair(a_0: int, a_1: int) -> nx.Graph:
+    network = nx.Graph()
+    network.add_edge(0, 1)
+    # b is always the same and c always differs by more than the agreement threshold, so the agents are close
+    network.nodes[0].update(a=a_0, b=3, c=0)
+    network.nodes[1].update(a=a_1, b=3, c=9)
+    WithinThresholdDistance().calculate_dissimilarity_networkwide(network, **PARAMETERS)
+    return network
+
+
+def _spread(network: nx.Graph, calls: int = 50) -> bool:
+    operator = AgreementThresholdSimilarityAdoption("one-to-one", **PARAMETERS)
+    rng = np.random.default_rng(0)
+    return any(operator.spread_influence(network, 0, 1, WithinThresholdDistance(), np_random_generator=rng,
+                                         **PARAMETERS) for _ in range(calls))
+
+
+def test_traits_outside_agreement_threshold_are_not_adopted():
+    # a differs by more than the agreement threshold, which was not detected when the neighbor was compared with
+    # itself instead of with the focal agent
+    network = _pair(0, 5)
+    assert not _spread(network)
+    assert network.nodes[1]["a"] == 5
+
+
+def test_traits_within_agreement_threshold_are_adopted():
+    network = _pair(0, 1)
+    assert _spread(network)
+    assert network.nodes[1]["a"] == 0
+
+
+def test_traits_set_directly_on_the_network_are_used():
+    network = _pair(0, 5)
+    network.nodes[1]["a"] = 1
+    assert _spread(network)
+    assert network.nodes[1]["a"] == 0
+
+
+def test_attributes_added_directly_on_the_network_are_used():
+    network = _pair(0, 0)
+    for node in network:
+        network.nodes[node]["d"] = node
+    assert _spread(network)
+    assert network.nodes[1]["d"] == 0
+
+
+def test_interactions_without_incongruent_traits_do_not_draw():
+    network = _pair(0, 5)
+    operator = AgreementThresholdSimilarityAdoption("one-to-one", **PARAMETERS)
+    rng = np.random.default_rng(0)
+    state = rng.bit_generator.state
+    assert not operator.spread_influence(network, 0, 1, WithinThresholdDistance(), np_random_generator=rng,
+                                         **PARAMETERS)
+    assert rng.bit_generator.state == state
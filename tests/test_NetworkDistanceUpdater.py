@@ -0,0 +1,17 @@
+import networkx as nx
+from defSim.dissimilarity_component.WithinThresholdDistance import WithinThresholdDistance
+from defSim.tools.NetworkDistanceUpdater import update_dissimilarity
+
+
+def test_traits_of_neighbors_set_directly_are_used_at_any_degree():
+    for leaves in (10, 40):
+        network = nx.star_graph(leaves)
+        for node in network:
+            network.nodes[node].update(a=0, b=0)
+        calculator = WithinThresholdDistance()
+        calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=0)
+        network.nodes[1]["a"] = 5
+        update_dissimilarity(network, [0], calculator, agreement_threshold=0)
+        assert network.edges[0, 1]["dist"] == 0.5
+        for neighbor in range(2, leaves + 1):
+            assert network.edges[0, neighbor]["dist"] == 1
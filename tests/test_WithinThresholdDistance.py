@@ -0,0 +1,81 @@
+import networkx as nx
+import numpy as np
+from defSim.dissimilarity_component.WithinThresholdDistance import WithinThresholdDistance, \
+    _count_packed_matches, _count_row_matches
+
+
+def _network(rng: np.random.Generator, n_features: int, n_traits: int) -> nx.Graph:
+    network = nx.gnm_random_graph(40, 120, seed=int(rng.integers(2 ** 31)))
+    for node in network:
+        network.nodes[node].update({"f%d" % k: int(rng.integers(-n_traits, n_traits + 1)) for k in range(n_features)})
+    return network
+
+
+def test_packed_matches_equal_row_matches():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n_traits = int(2 ** rng.integers(0, 24))
+        network = _network(rng, int(rng.integers(1, 40)), n_traits)
+        calculator = WithinThresholdDistance()
+        calculator.at = int(rng.integers(0, 2 * n_traits + 2))
+        matrix, columns = calculator._build_feature_matrix(network, rebuild=True)
+        rows, guards, thresholds = calculator._pack_rows(matrix, columns)
+        src = rng.integers(0, 40, 500)
+        dst = rng.integers(0, 40, 500)
+        features = calculator._kept_features(matrix, columns)
+        np.testing.assert_array_equal(_count_packed_matches(rows[src], rows[dst], guards, thresholds),
+                                      _count_row_matches(features[src], features[dst], calculator.at))
+
+
+def test_numpy_matches_accept_any_agreement_threshold():
+    rng = np.random.default_rng(1)
+    for at in (2.5, 0.5, -1, 3.0):
+        network = _network(rng, 10, 6)
+        calculator = WithinThresholdDistance()
+        calculator.at = at
+        matrix, columns = calculator._build_feature_matrix(network, rebuild=True)
+        src = rng.integers(0, 40, 500)
+        dst = rng.integers(0, 40, 500)
+        features = np.abs(matrix.values[:, columns])
+        np.testing.assert_array_equal(calculator._count_matches(matrix, columns, src, dst),
+                                      np.count_nonzero(np.abs(features[src] - features[dst]) <= at, axis=1))
+
+
+def _assert_distances(network: nx.Graph, calculator: WithinThresholdDistance, at):
+    for agent, neighbor, dist in network.edges(data="dist"):
+        assert dist == calculator.calculate_dissimilarity(network, agent, neighbor, agreement_threshold=at)
+
+
+def test_networkwide_recomputes_changed_edges():
+    rng = np.random.default_rng(2)
+    network = _network(rng, 6, 4)
+    calculator = WithinThresholdDistance()
+    calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=1)
+    _assert_distances(network, calculator, 1)
+    for agent in rng.choice(40, 5, replace=False).tolist():
+        network.nodes[agent]["f2"] = int(rng.integers(-4, 5))
+    calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=1)
+    _assert_distances(network, calculator, 1)
+    # removing and adding the last edge again leaves the edge list the same, but the edge without a distance
+    agent, neighbor = list(network.edges())[-1]
+    network.remove_edge(agent, neighbor)
+    network.add_edge(agent, neighbor)
+    calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=1)
+    _assert_distances(network, calculator, 1)
+    nx.set_edge_attributes(network, 0.42, "dist")
+    calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=1)
+    _assert_distances(network, calculator, 1)
+    calculator.calculate_dissimilarity_networkwide(network, agreement_threshold=2)
+    _assert_distances(network, calculator, 2)
+
+
+def test_matrix_equals_pairwise_distances():
+    rng = np.random.default_rng(3)
+    network = _network(rng, 8, 4)
+    for exclude in ([], ["f1", "f5"], ["f%d" % k for k in range(8)]):
+        for at in (0, 1, 2.5):
+            calculator = WithinThresholdDistance(exclude=exclude)
+            distances = calculator.calculate_dissimilarity_matrix(network, agreement_threshold=at)
+            expected = [[calculator.calculate_dissimilarity(network, agent, other, agreement_threshold=at)
+                         for other in network] for agent in network]
+            np.testing.assert_array_equal(distances, expected)
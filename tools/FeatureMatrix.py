@@ -0,0 +1,125 @@
+from typing import List
+import weakref
+import networkx as nx
+import numpy as np
+
+# one cached matrix per network, dropped automatically when the network itself is garbage collected
+_feature_matrices = weakref.WeakKeyDictionary()
+
+
+class FeatureMatrix:
+    """
+    A structure-of-arrays copy of the agent features of a network. Every agent is a row and every feature a column,
+    so that agents can be compared with vectorized NumPy operations instead of dict lookups per feature.
+
+    The matrix is kept in sync with the network by :func:`~defSim.tools.NetworkDistanceUpdater.update_dissimilarity`,
+    which refreshes the rows of all agents whose features changed and bumps the version counter. Next to that, every
+    row has its own version, which is bumped whenever the features of that agent change, so that calculators can tell
+    which of their earlier results are still up to date.
+    """
+
+    def __init__(self, network: nx.Graph):
+        """
+        :param network: The network whose agent features are copied. All agents are expected to have the same features.
+        """
+        self.nodes = list(network.nodes())
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.features = list(network.nodes[self.nodes[0]].keys()) if self.nodes else []
+        self.version = 0
+        self.versions = np.zeros(len(self.nodes), dtype=np.int64)
+        self.values = self._read_values(network)
+
+    def _read_values(self, network: nx.Graph) -> np.ndarray:
+        columns = [nx.get_node_attributes(network, feature) for feature in self.features]
+        if columns:
+            values = np.column_stack([np.array([column[node] for node in self.nodes]) for column in columns])
+        else:
+            values = np.empty((len(self.nodes), 0))
+        return _narrowest(values)
+
+    def refresh(self, network: nx.Graph, agents: List[int]):
+        """
+        Copies the current features of the given agents from the network into their rows.
+
+        :param network: The network the matrix was built from.
+        :param agents: The agents whose features may have changed.
+        """
+        for agent in agents:
+            node = network.nodes[agent]
+            row = self.index[agent]
+            values = _narrowest(np.array([node[feature] for feature in self.features]))
+            dtype = np.result_type(values, self.values)
+            if dtype != self.values.dtype:
+                # the new values do not fit the current dtype, widen the matrix rather than truncate them
+                self.values = self.values.astype(dtype)
+            self.values[row] = values
+            self.versions[row] += 1
+        self.version += 1
+
+    def reload(self, network: nx.Graph):
+        """
+        Copies the current features of all agents from the network, bumping the versions of the rows that changed.
+
+        :param network: The network the matrix was built from, with the same agents and features.
+        """
+        values = self._read_values(network)
+        if values.shape == self.values.shape:
+            self.versions[np.any(values != self.values, axis=1)] += 1
+        else:
+            self.versions += 1
+        self.values = values
+        self.version += 1
+
+
+def _narrowest(values: np.ndarray) -> np.ndarray:
+    """
+    Converts integer values to the smallest signed integer type that holds them and their absolute values. Ordinal
+    traits typically fit int8, which makes a row of features a few bytes instead of a few cache lines.
+
+    :param values: The values to convert. Non-integer values are returned unchanged.
+    :returns: The converted values.
+    """
+    if values.dtype.kind not in "iub":
+        return values
+    largest = int(np.abs(values.astype(np.int64)).max(initial=0))
+    for dtype in (np.int8, np.int16, np.int32):
+        if largest <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def get_feature_matrix(network: nx.Graph, rebuild: bool = False) -> FeatureMatrix:
+    """
+    Returns the cached FeatureMatrix of a network, building it if there is none yet or if the agents changed.
+
+    :param network: The network in which the agents exist.
+    :param rebuild: If True, the values of all agents are read again, e.g. after all agent features were initialized.
+        The matrix is built from scratch if the agents or their features changed.
+    :returns: The FeatureMatrix of the network.
+    """
+    matrix = _feature_matrices.get(network)
+    if matrix is not None and rebuild and matrix.nodes == list(network.nodes()) and \
+            (not matrix.nodes or matrix.features == list(network.nodes[matrix.nodes[0]].keys())):
+        # same agents and features, only reload the values so that the row versions tell what changed
+        matrix.reload(network)
+    elif rebuild or matrix is None or len(matrix.nodes) != network.number_of_nodes():
+        matrix = FeatureMatrix(network)
+        _feature_matrices[network] = matrix
+    return matrix
+
+
+def refresh_feature_matrix(network: nx.Graph, agents: List[int]):
+    """
+    Refreshes the rows of the given agents in the cached FeatureMatrix of a network, if one was built.
+
+    :param network: The network in which the agents exist.
+    :param agents: The agents whose features may have changed.
+    """
+    matrix = _feature_matrices.get(network)
+    if matrix is None:
+        return
+    if any(agent not in matrix.index for agent in agents):
+        # agents were added since the matrix was built, rebuild it on the next access
+        del _feature_matrices[network]
+    else:
+        matrix.refresh(network, agents)
@@ -1,31 +1,34 @@
 from typing import List
 from defSim.dissimilarity_component.dissimilarity_calculator import DissimilarityCalculator
+from defSim.tools.FeatureMatrix import refresh_feature_matrix
 import networkx as nx
 
 
 def update_dissimilarity(network: nx.Graph, agents: List[int], calculator: DissimilarityCalculator, **kwargs):
     """
     This method recomputes the edges between a certain set of agents and all their neighbors and then modifies
-    the edges between them respectively.
+    the edges between them respectively. Edges between two of the given agents are only computed once.
 
     :param calculator: An implementation of the DissimilarityCalculator class
     :param network: The network that is updated.
     :param agents: A list containing the indices of all agents whose edges should be updated.
     """
-    for agent in agents:  # all ties in Graph and all outgoing ties in DiGraph
-        for neighbor in network.neighbors(agent):
-            network.edges[agent, neighbor]['dist'] = calculator.calculate_dissimilarity(network,
-                                                                                        agent,
-                                                                                        neighbor,
-                                                                                        **kwargs)
-        try:  # for incoming ties in DiGraphs
-            for neighbor in network.predecessors(agent):
-                network.edges[neighbor, agent]['dist'] = calculator.calculate_dissimilarity(network,
-                                                                                            agent,
-                                                                                            neighbor,
-                                                                                            **kwargs)
-        except:
-            pass
+    refresh_feature_matrix(network, agents)
+    directed = network.is_directed()
+    network_edges = network.edges
+    updated = set()
+    for agent in agents:
+        # all ties in Graph and all outgoing ties in DiGraph
+        edges = [(agent, neighbor) for neighbor in network.neighbors(agent)]
+        if directed:  # for incoming ties in DiGraphs
+            edges.extend((neighbor, agent) for neighbor in network.predecessors(agent))
+        edges = [edge for edge in edges if edge not in updated]
+        updated.update(edges)
+        if not directed:
+            updated.update((neighbor, agent) for agent, neighbor in edges)
+        for edge in edges:
+            neighbor = edge[0] if edge[1] == agent else edge[1]
+            network_edges[edge]['dist'] = calculator.calculate_dissimilarity(network, agent, neighbor, **kwargs)
 
 
 def check_dissimilarity(network: nx.Graph, maximum: float, minimum: float = 0):